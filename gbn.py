@@ -3,6 +3,9 @@ import socket
 import struct
 import time
 
+from pkt_trace import (EV_SEND, EV_RETRANS, EV_RECV, EV_ACK, EV_DROP, EV_RTO,
+                       KIND_GBN, DROP_LOSS, DROP_CHECKSUM, DROP_ORDER)
+
 # constants
 HEADER_SIZE = 4
 BUFFER_SIZE = 4096
@@ -56,7 +59,7 @@ def make_pkt(seqNum, ackNum, data, start=False, stop=False, ack=False):
 
 class GBNSocket:
     def __init__(self, timeout=TIMEOUT,
-                    windowSize=WINDOW_SIZE, lossRate=LOSS_RATE):
+                    windowSize=WINDOW_SIZE, lossRate=LOSS_RATE, tracer=None):
         # socket config
         self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.timeout = timeout
@@ -79,8 +82,14 @@ class GBNSocket:
         self.rbase = 0              # receive base (not return yet)
         self.rexpect = 0            # receive expect
 
+        # packet trace (optional)
+        self.tracer = tracer
+        self.trace_conn = tracer.register(KIND_GBN, windowSize) if tracer else 0
+
 
-    def udp_send(self, pkt):
+    def udp_send(self, pkt, retrans=False):
+        # traced as sent even when lost, the loss is a separate drop event
+        self._trace(EV_RETRANS if retrans else EV_SEND, pkt)
         if self.loss_rate == 0 or random.randint(0, int(1 / self.loss_rate)) != 1:
             self.udp_socket.sendto(pkt, self.address)
             print('[Send] SEQ =', pkt[0], ', ACK =', pkt[1], end=' ')
@@ -93,9 +102,23 @@ class GBNSocket:
             print()
         else:
             print('[Send] Packet lost.')
+            self._trace(EV_DROP, pkt, value=DROP_LOSS)
         time.sleep(0.05)
 
 
+    def _trace(self, event, pkt=b"", seq=0, value=0):
+        if self.tracer is None:
+            return
+        if len(pkt) >= HEADER_SIZE:
+            self.tracer.record(self.trace_conn, event, pkt[0], pkt[1], pkt[2], len(pkt)-HEADER_SIZE, value)
+        else:
+            self.tracer.record(self.trace_conn, event, seq, value=value)
+
+
+    def _trace_recv(self, pkt):
+        self._trace(EV_ACK if pkt[2] & ACK else EV_RECV, pkt)
+
+
     def connect(self, address):
         if (self.connected):
             print(f"[error] You have connected to addr {self.address}")
@@ -115,6 +138,7 @@ class GBNSocket:
             try:
                 rcvpkt = self.udp_socket.recv(HEADER_SIZE+BUFFER_SIZE)
                 seqNum, ackNum, flag, checksum, data = analyse_pkt(rcvpkt)
+                self._trace_recv(rcvpkt)
                 if (flag & SYN) and (flag & ACK) and (ackNum == self.sbase):
                     self.connected = True
                     self.rbase = (seqNum + 1) % 256
@@ -165,6 +189,7 @@ class GBNSocket:
             try:
                 rcvpkt = self.udp_socket.recv(HEADER_SIZE+BUFFER_SIZE)
                 seqNum, ackNum, flag, checksum, data = analyse_pkt(rcvpkt)
+                self._trace_recv(rcvpkt)
             
                 if (flag & SYN):
                     synack_pack = make_pkt(self.snext, self.rexpect, b"", start=True, ack=True)
@@ -189,6 +214,11 @@ class GBNSocket:
                     self.connected = False
                     return False
                 # save data
+                if not (flag & ACK):
+                    if getChecksum(data) != checksum:
+                        self._trace(EV_DROP, rcvpkt, value=DROP_CHECKSUM)
+                    elif seqNum != self.rexpect:
+                        self._trace(EV_DROP, rcvpkt, value=DROP_ORDER)
                 if seqNum == self.rexpect and getChecksum(data) == checksum:
                     self.rexpect = (self.rexpect + 1) % 256
                     self.rdata[seqNum] = data
@@ -204,11 +234,12 @@ class GBNSocket:
                     return True
 
                 print("[timeout] resend")
+                self._trace(EV_RTO, seq=self.sbase)
                 i = self.sbase
                 while i != self.snext:
                     print('Sender resend packet:', i)
                     pkt = make_pkt(i, self.rexpect, self.sdata[i])
-                    self.udp_send(pkt)
+                    self.udp_send(pkt, retrans=True)
                     i = (i + 1) % 256
 
                 self.udp_socket.settimeout(self.timeout)  # reset timer
@@ -235,6 +266,8 @@ class GBNSocket:
     def close(self):
         if (not self.connected):
             print("[info] FIN...")
+            if self.tracer:
+                self.tracer.flush()
             return
 
         # send FIN
@@ -251,6 +284,7 @@ class GBNSocket:
             try:
                 rcvpkt = self.udp_socket.recv(HEADER_SIZE+BUFFER_SIZE)
                 seqNum, ackNum, flag, checksum, data = analyse_pkt(rcvpkt)
+                self._trace_recv(rcvpkt)
                 if flag & FIN and flag & ACK and ackNum == self.snext:
                     self.connected = False
                     print("[info] FIN...")
@@ -261,6 +295,9 @@ class GBNSocket:
                 print("[timeout] FIN ACK")
                 self.udp_send(fin_pack)
 
+        if self.tracer:
+            self.tracer.flush()
+
 
     def bind(self, address):
         self.address = address
@@ -282,6 +319,7 @@ class GBNSocket:
         self.udp_socket.settimeout(None)
         rcvpkt, address = self.udp_socket.recvfrom(HEADER_SIZE+BUFFER_SIZE)
         seqNum, ackNum, flag, checksum, data = analyse_pkt(rcvpkt)
+        self._trace_recv(rcvpkt)
         if flag & SYN:
             print("[info] SYN from", address)
             self.connected = True
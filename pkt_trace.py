@@ -0,0 +1,105 @@
+import struct
+import threading
+import time
+
+# file format: MAGIC, then fixed size records
+MAGIC = b'RDTTRACE'
+RECORD = struct.Struct('<dHBBBBHI')     # time, conn, event, seq, ack, flag, len, value
+RECORD_SIZE = RECORD.size
+CAPACITY = 4096                         # records kept in memory before flushing
+
+# events
+EV_CONN = 0         # value: socket kind
+EV_SEND = 1
+EV_RETRANS = 2
+EV_RECV = 3         # data packet received
+EV_ACK = 4          # ACK packet received
+EV_DROP = 5         # value: drop reason
+EV_CWND = 6         # value: new window size
+EV_RTO = 7          # seq: timed out packet
+
+EVENT_NAMES = ['conn', 'send', 'retrans', 'recv', 'ack', 'drop', 'cwnd', 'rto']
+
+# socket kind
+KIND_GBN = 0
+KIND_SR = 1
+
+# drop reason
+DROP_LOSS = 0       # simulated loss in udp_send, follows the send / retrans event
+DROP_CHECKSUM = 1
+DROP_WINDOW = 2     # outside receive window
+DROP_ORDER = 3      # out of order, GBN keeps only the expected packet
+
+DROP_NAMES = ['loss', 'checksum', 'window', 'order']
+
+
+class PacketTracer:
+    def __init__(self, path=None, capacity=CAPACITY):
+        # without a path the buffer is a flight recorder: old records get overwritten
+        self.path = path
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * RECORD_SIZE)
+        self.head = 0               # next slot to write
+        self.count = 0              # valid records in buffer
+        self.nconn = 0
+        self.lock = threading.Lock()
+
+        if self.path is not None:
+            with open(self.path, 'wb') as f:
+                f.write(MAGIC)
+
+
+    def register(self, kind, window_size):
+        with self.lock:
+            conn = self.nconn
+            self.nconn += 1
+        self.record(conn, EV_CONN, value=kind)
+        self.record(conn, EV_CWND, value=window_size)
+        return conn
+
+
+    def record(self, conn, event, seq=0, ack=0, flag=0, length=0, value=0):
+        with self.lock:
+            RECORD.pack_into(self.buffer, self.head * RECORD_SIZE,
+                             time.time(), conn, event, seq, ack, flag, length, value)
+            self.head = (self.head + 1) % self.capacity
+            if self.count < self.capacity:
+                self.count += 1
+            if self.path is not None and self.count == self.capacity:
+                self._flush()
+
+
+    def records(self):
+        # records still in memory, oldest first
+        with self.lock:
+            start = (self.head - self.count) % self.capacity
+            return [RECORD.unpack_from(self.buffer, ((start + i) % self.capacity) * RECORD_SIZE)
+                    for i in range(self.count)]
+
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+
+    def _flush(self):
+        if self.path is None or self.count == 0:
+            return
+        start = (self.head - self.count) % self.capacity
+        with open(self.path, 'ab') as f:
+            if start + self.count <= self.capacity:
+                f.write(self.buffer[start*RECORD_SIZE:(start+self.count)*RECORD_SIZE])
+            else:
+                f.write(self.buffer[start*RECORD_SIZE:])
+                f.write(self.buffer[:self.head*RECORD_SIZE])
+        self.count = 0
+
+
+def read_trace(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a trace file")
+    data = data[len(MAGIC):]
+    n = len(data) // RECORD_SIZE
+    return [RECORD.unpack_from(data, i * RECORD_SIZE) for i in range(n)]
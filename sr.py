@@ -1,8 +1,13 @@
+import queue
 import random
 import socket
 import struct
+import threading
 import time
 
+from pkt_trace import (EV_SEND, EV_RETRANS, EV_RECV, EV_ACK, EV_DROP, EV_CWND, EV_RTO,
+                       KIND_SR, DROP_LOSS, DROP_CHECKSUM, DROP_WINDOW)
+
 # constants
 HEADER_SIZE = 4
 BUFFER_SIZE = 4096
@@ -11,6 +16,9 @@ BASIC_TIMEOUT = 0.5
 WINDOW_SIZE = 3
 LOSS_RATE = 0.2
 MAX_TIMEOUT = 10
+QUEUE_SIZE = 64         # threaded mode: max packets buffered between app and I/O thread
+IO_INTERVAL = 0.05      # threaded mode: I/O thread poll interval
+IO_WINDOW = 64          # threaded mode: max packets in flight / receive window
 
 # FLAG
 SYN = 1
@@ -57,7 +65,8 @@ def make_pkt(seqNum, ackNum, data, start=False, stop=False, ack=False):
 
 class SRSocket:
     def __init__(self, timeout=TIMEOUT,
-                    windowSize=WINDOW_SIZE, lossRate=LOSS_RATE):
+                    windowSize=WINDOW_SIZE, lossRate=LOSS_RATE,
+                    threaded=False, queueSize=QUEUE_SIZE, tracer=None):
         # socket config
         self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.timeout = timeout
@@ -74,6 +83,7 @@ class SRSocket:
         self.spos = 0               # send position (last available packet + 1)
         self.sbase = 0              # send base
         self.snext = 0              # send next seq number
+        self.syn_seq = 0            # seq in our SYN / SYN ACK
 
         self.sclkq = []             # send clock queue (seq:timestamp)
 
@@ -85,8 +95,22 @@ class SRSocket:
         self.rbase = 0              # receive base (not return yet)
         self.rexpect = 0            # receive expect
 
+        # background I/O thread (threaded mode)
+        self.threaded = threaded
+        self.squeue = queue.Queue(maxsize=queueSize)    # app -> I/O thread
+        self.rqueue = queue.Queue(maxsize=queueSize)    # I/O thread -> app
+        self.io_thread = None
+        self.io_stop = threading.Event()
+        self.io_heard = 0           # packets the I/O thread got from the peer
+
+        # packet trace (optional)
+        self.tracer = tracer
+        self.trace_conn = tracer.register(KIND_SR, windowSize) if tracer else 0
+
 
-    def udp_send(self, pkt):
+    def udp_send(self, pkt, retrans=False):
+        # traced as sent even when lost, the loss is a separate drop event
+        self._trace(EV_RETRANS if retrans else EV_SEND, pkt)
         if self.loss_rate == 0 or random.randint(0, int(1 / self.loss_rate)) != 1:
             self.udp_socket.sendto(pkt, self.address)
             print('[Send] SEQ =', pkt[0], ', ACK =', pkt[1], end=' ')
@@ -99,9 +123,23 @@ class SRSocket:
             print()
         else:
             print('[Send] Packet lost.')
+            self._trace(EV_DROP, pkt, value=DROP_LOSS)
         time.sleep(0.01)
 
 
+    def _trace(self, event, pkt=b"", seq=0, value=0):
+        if self.tracer is None:
+            return
+        if len(pkt) >= HEADER_SIZE:
+            self.tracer.record(self.trace_conn, event, pkt[0], pkt[1], pkt[2], len(pkt)-HEADER_SIZE, value)
+        else:
+            self.tracer.record(self.trace_conn, event, seq, value=value)
+
+
+    def _trace_recv(self, pkt):
+        self._trace(EV_ACK if pkt[2] & ACK else EV_RECV, pkt)
+
+
     def connect(self, address):
         if (self.connected):
             print(f"[error] You have connected to addr {self.address}")
@@ -113,7 +151,8 @@ class SRSocket:
         self.spos  = self.sbase
 
         self.address = address
-        syn_pack = make_pkt((self.sbase-1)%256, 0, b"", start=True)
+        self.syn_seq = (self.sbase-1)%256
+        syn_pack = make_pkt(self.syn_seq, 0, b"", start=True)
         self.udp_send(syn_pack)
 
         self.udp_socket.settimeout(self.timeout)
@@ -121,6 +160,7 @@ class SRSocket:
             try:
                 rcvpkt = self.udp_socket.recv(HEADER_SIZE+BUFFER_SIZE)
                 seqNum, ackNum, flag, checksum, data = analyse_pkt(rcvpkt)
+                self._trace_recv(rcvpkt)
                 if (flag & SYN) and (flag & ACK) and (ackNum == self.sbase):
                     self.connected = True
                     self.rbase = (seqNum + 1) % 256
@@ -131,11 +171,18 @@ class SRSocket:
                 print("[timeout] SYN ACK")
                 self.udp_send(syn_pack)
 
+        if self.threaded:
+            self._start_io()
+
 
     def send(self, data):
         if (not self.connected):
             print("[error] not connected")
             return
+
+        if self.threaded:
+            self._send_threaded(data)
+            return
         
         if data == b'':
             self.sdata[self.spos] = data
@@ -175,93 +222,283 @@ class SRSocket:
                 break
             try:
                 rcvpkt = self.udp_socket.recv(HEADER_SIZE+BUFFER_SIZE)
-                seqNum, ackNum, flag, checksum, data = analyse_pkt(rcvpkt)
                 timeout_count = 0
-            
-                if (flag & SYN):
-                    synack_pack = make_pkt(self.snext, self.rexpect, b"", start=True, ack=True)
-                    self.udp_send(synack_pack)
-                    continue
-
-                # handle ACK
-                if (flag & ACK):
-                    # update clock queue
-                    crt_min_unacked = self.snext
-                    i = 0
-                    while i < len(self.sclkq):
-                        crt = self.sclkq[i][0]
-                        if ackNum == crt:
-                            self.sclkq.pop(i)
-                        else:
-                            if (crt - self.sbase) % 256 < (self.snext - self.sbase) % 256:  # in window
-                                if crt < WINDOW_SIZE:
-                                    crt += 256
-                                if crt < crt_min_unacked:
-                                    crt_min_unacked = crt
-                            i += 1
-                    crt_min_unacked %= 256
-                    
-                    if self.sbase != crt_min_unacked:
-                        # update window size (congestion control)
-                        self.ackcount += (crt_min_unacked - self.sbase) % 256
-                        if self.ackcount >= self.window_size:
-                            print('[CNG_CTRL] add window size from', self.window_size, 'to', self.window_size+1)
-                            self.window_size += 1
-                            self.ackcount = 0
-
-                        self.sbase = crt_min_unacked
-                        self.udp_socket.settimeout(None)
-                        return True
-                    else:
-                        continue
-
-                # handle FIN
-                if (flag & FIN):
-                    ack_pkt = make_pkt((self.snext-1)%256, self.rexpect, b"", ack=True, stop=True)
-                    self.udp_send(ack_pkt)
-                    self.udp_socket.settimeout(None)
-                    self.connected = False
-                    return False
-                
-                # save data
-                if getChecksum(data) == checksum:
-                    if self.rdata[seqNum] is None:
-                        # print('[Debug] Fill data at', seqNum, 'with', len(data))
-                        self.rdata[seqNum] = data
-
-                    # send ACK
-                    ack_pkt = make_pkt((self.snext-1)%256, seqNum, b"", ack=True)
-                    self.udp_send(ack_pkt)
 
-                    # update rexpect
-                    i = self.rexpect
-                    while not self.rdata[i] is None:
-                        self.rexpect = (self.rexpect + 1) % 256
-                        i = self.rexpect
+                result = self._handle_pkt(rcvpkt)
+                if result is not None:
+                    self.udp_socket.settimeout(None)
+                    return result
 
             except socket.timeout:
                 if (recv):
                     return True
 
-                # check clock queue
-                while len(self.sclkq) > 0:
-                    if time.time() - self.sclkq[0][1] >= self.timeout:
-                        pkt = make_pkt(self.sclkq[0][0], self.rexpect, self.sdata[self.sclkq[0][0]])
-                        self.udp_send(pkt)
-                        self.sclkq.append((self.sclkq[0][0], time.time()))
-                        del self.sclkq[0]
-
-                        # update window size (congestion control)
-                        new_window_size = max(2, self.window_size // 2)
-                        print('[CNG_CTRL] reduce window size from', self.window_size, 'to', new_window_size)
-                        self.window_size = new_window_size
-                    else:
-                        break
+                self._check_clock()
 
         return False
 
 
+    def _handle_pkt(self, rcvpkt):
+        # return True if send base moved, False if connection finished, None otherwise
+        seqNum, ackNum, flag, checksum, data = analyse_pkt(rcvpkt)
+        self._trace_recv(rcvpkt)
+
+        if (flag & SYN):
+            # peer missed our SYN ACK, send the same one again
+            if not (flag & ACK):
+                synack_pack = make_pkt(self.syn_seq, self.rexpect, b"", start=True, ack=True)
+                self.udp_send(synack_pack)
+            return None
+
+        # handle ACK
+        if (flag & ACK):
+            # update clock queue
+            min_offset = (self.snext - self.sbase) % 256
+            i = 0
+            while i < len(self.sclkq):
+                crt = self.sclkq[i][0]
+                if ackNum == crt:
+                    self.sclkq.pop(i)
+                else:
+                    offset = (crt - self.sbase) % 256
+                    if offset < min_offset:     # in window
+                        min_offset = offset
+                    i += 1
+            crt_min_unacked = (self.sbase + min_offset) % 256
+
+            if self.sbase != crt_min_unacked:
+                # update window size (congestion control)
+                self.ackcount += (crt_min_unacked - self.sbase) % 256
+                if self.ackcount >= self.window_size:
+                    print('[CNG_CTRL] add window size from', self.window_size, 'to', self.window_size+1)
+                    self.window_size += 1
+                    self.ackcount = 0
+                    self._trace(EV_CWND, value=self.window_size)
+
+                self.sbase = crt_min_unacked
+                return True
+            return None
+
+        # handle FIN
+        if (flag & FIN):
+            ack_pkt = make_pkt((self.snext-1)%256, self.rexpect, b"", ack=True, stop=True)
+            self.udp_send(ack_pkt)
+            self.connected = False
+            return False
+
+        # save data
+        if getChecksum(data) == checksum:
+            if self.threaded:
+                # receive window is [rbase, rbase+IO_WINDOW), seq behind it was delivered already
+                if (seqNum - self.rbase) % 256 >= 2 * IO_WINDOW:
+                    ack_pkt = make_pkt((self.snext-1)%256, seqNum, b"", ack=True)
+                    self.udp_send(ack_pkt)
+                    return None
+                if (seqNum - self.rbase) % 256 >= IO_WINDOW:
+                    self._trace(EV_DROP, rcvpkt, value=DROP_WINDOW)
+                    return None     # no room yet, let the peer retransmit
+
+            if self.rdata[seqNum] is None:
+                # print('[Debug] Fill data at', seqNum, 'with', len(data))
+                self.rdata[seqNum] = data
+                self._on_data(seqNum, data)
+
+            # send ACK
+            ack_pkt = make_pkt((self.snext-1)%256, seqNum, b"", ack=True)
+            self.udp_send(ack_pkt)
+
+            # update rexpect
+            i = self.rexpect
+            while not self.rdata[i] is None:
+                self.rexpect = (self.rexpect + 1) % 256
+                i = self.rexpect
+        else:
+            self._trace(EV_DROP, rcvpkt, value=DROP_CHECKSUM)
+        return None
+
+
+    def _check_clock(self, max_resend=None):
+        # resend timed out packets, return how many were resent
+        resent = 0
+        while len(self.sclkq) > 0 and (max_resend is None or resent < max_resend):
+            if time.time() - self.sclkq[0][1] >= self.timeout:
+                self._trace(EV_RTO, seq=self.sclkq[0][0])
+                pkt = make_pkt(self.sclkq[0][0], self.rexpect, self.sdata[self.sclkq[0][0]])
+                self.udp_send(pkt, retrans=True)
+                self.sclkq.append((self.sclkq[0][0], time.time()))
+                del self.sclkq[0]
+
+                # update window size (congestion control)
+                new_window_size = max(2, self.window_size // 2)
+                print('[CNG_CTRL] reduce window size from', self.window_size, 'to', new_window_size)
+                self.window_size = new_window_size
+                self._trace(EV_CWND, value=self.window_size)
+                resent += 1
+            else:
+                break
+        return resent
+
+
+    def _start_io(self):
+        self.io_stop.clear()
+        self.io_thread = threading.Thread(target=self._io_loop, daemon=True)
+        self.io_thread.start()
+
+
+    def _io_loop(self):
+        # the I/O thread owns udp_socket, sdata/rdata and the clock queue until it stops
+        timeout_count = 0   # resends since the last ACK
+        while self.connected:
+            # close() was called and everything queued is acked
+            if self.io_stop.is_set() and not self._send_pending() and self.sbase == self.spos:
+                break
+
+            self._fill()
+
+            # send new packets: cwnd bounds the unacked packets, not the span from sbase,
+            # so one lost packet does not stop everything sent after it
+            while (len(self.sclkq) < self.window_size and (self.snext - self.sbase) % 256 < IO_WINDOW
+                   and self.snext != self.spos):
+                pkt = make_pkt(self.snext, self.rexpect, self.sdata[self.snext])
+                self.udp_send(pkt)
+                self.sclkq.append((self.snext, time.time()))    # add to clock queue
+                self.snext = (self.snext + 1) % 256
+
+            self._deliver()
+
+            # read everything already waiting before looking at the clock,
+            # so pending ACKs cancel their resends
+            self.udp_socket.settimeout(IO_INTERVAL)
+            try:
+                for i in range(IO_WINDOW):
+                    rcvpkt = self.udp_socket.recv(HEADER_SIZE+BUFFER_SIZE)
+                    self.io_heard += 1
+                    if rcvpkt[2] & ACK:
+                        timeout_count = 0
+                    self._handle_pkt(rcvpkt)
+                    self._deliver()
+                    if not self.connected:
+                        break
+                    self.udp_socket.settimeout(0)
+            except (socket.timeout, BlockingIOError):
+                pass
+
+            # at most one resend (and one window cut) per pass, then read again
+            timeout_count += self._check_clock(max_resend=1)
+            if timeout_count >= MAX_TIMEOUT:
+                print("[ERROR] connection lost (timeout)")
+                self.connected = False
+
+        self.udp_socket.settimeout(None)
+
+
+    def _fill(self):
+        # move app data into the send buffer
+        while (self.spos - self.sbase) % 256 < IO_WINDOW:
+            try:
+                self.sdata[self.spos] = self.squeue.get_nowait()
+            except queue.Empty:
+                break
+            self.spos = (self.spos + 1) % 256
+
+
+    def _deliver(self):
+        # deliver received data to app
+        while self.rbase != self.rexpect:
+            try:
+                self.rqueue.put_nowait(self.rdata[self.rbase])
+            except queue.Full:
+                break
+            self.rdata[self.rbase] = None
+            self.rbase = (self.rbase + 1) % 256
+
+
+    def _on_data(self, seqNum, data):
+        # called by the receive path for every new data packet, in arrival order
+        pass
+
+
+    def _send_pending(self):
+        return not self.squeue.empty()
+
+
+    def _queue_put(self, q, item):
+        # blocks only while the queue is full
+        while True:
+            if not self.io_thread.is_alive():
+                print("[error] not connected")
+                return False
+            try:
+                q.put(item, timeout=BASIC_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+
+
+    def _queue_get(self, q):
+        # None once the I/O thread has stopped and the queue is empty;
+        # only silence from the peer counts as a timeout, a long transfer does not
+        timeout_count = 0
+        heard = self.io_heard
+        while True:
+            try:
+                return q.get(timeout=BASIC_TIMEOUT)
+            except queue.Empty:
+                if not self.io_thread.is_alive():
+                    break
+                if self.io_heard != heard:
+                    heard = self.io_heard
+                    timeout_count = 0
+                if timeout_count >= 50:
+                    raise Exception("[ERROR] connection lost (timeout)")
+                timeout_count += 1
+
+        # I/O thread stopped, its last delivery may still be in the queue
+        try:
+            return q.get_nowait()
+        except queue.Empty:
+            return None
+
+
+    def _send_threaded(self, data):
+        if data == b'':
+            data = [data]
+        else:
+            data = [data[i:i+BUFFER_SIZE] for i in range(0, len(data), BUFFER_SIZE)]
+
+        for pkt_data in data:
+            if not self._queue_put(self.squeue, pkt_data):
+                return
+
+
+    def _recv_threaded(self, size):
+        data = self._queue_get(self.rqueue)
+        if data is not None:
+            return data[:size]
+
+        # I/O thread stopped, take what is left in the receive buffer
+        if self.rbase == self.rexpect:
+            return b""
+        data = self.rdata[self.rbase]
+        self.rdata[self.rbase] = None
+        self.rbase = (self.rbase + 1) % 256
+        return data[:size]
+
+
+    def _stop_io(self):
+        # the I/O thread exits once everything queued is acked, then the socket is ours again
+        self.io_stop.set()
+        self.io_thread.join(self.timeout * (MAX_TIMEOUT + 1))
+        if self.io_thread.is_alive():
+            print("[ERROR] I/O thread did not stop")
+            self.connected = False     # makes the loop exit on its next pass
+            self.io_thread.join(self.timeout)
+
+
     def recv(self, size=BUFFER_SIZE):
+        if self.threaded and self.io_thread is not None:
+            return self._recv_threaded(size)
+
         timeout_count = 0
         while self.rbase == self.rexpect:
             if (not self.connected):
@@ -278,8 +515,13 @@ class SRSocket:
 
     
     def close(self):
+        if self.threaded and self.io_thread is not None:
+            self._stop_io()
+
         if (not self.connected):
             print("[info] FIN...")
+            if self.tracer:
+                self.tracer.flush()
             return
 
         # send FIN
@@ -297,6 +539,7 @@ class SRSocket:
             try:
                 rcvpkt = self.udp_socket.recv(HEADER_SIZE+BUFFER_SIZE)
                 seqNum, ackNum, flag, checksum, data = analyse_pkt(rcvpkt)
+                self._trace_recv(rcvpkt)
                 if flag & FIN and flag & ACK:
                     self.connected = False
                     print("[info] FIN...")
@@ -307,6 +550,9 @@ class SRSocket:
                 print("[timeout] FIN ACK")
                 self.udp_send(fin_pack)
 
+        if self.tracer:
+            self.tracer.flush()
+
 
     def bind(self, address):
         self.address = address
@@ -328,6 +574,7 @@ class SRSocket:
         self.udp_socket.settimeout(None)
         rcvpkt, address = self.udp_socket.recvfrom(HEADER_SIZE+BUFFER_SIZE)
         seqNum, ackNum, flag, checksum, data = analyse_pkt(rcvpkt)
+        self._trace_recv(rcvpkt)
         if flag & SYN:
             print("[info] SYN from", address)
             self.connected = True
@@ -338,8 +585,12 @@ class SRSocket:
             self.snext = self.sbase
             self.spos  = self.sbase
 
-            synack_pack = make_pkt((self.sbase-1)%256, self.rexpect, b"", start=True, ack=True)
+            self.syn_seq = (self.sbase-1)%256
+            synack_pack = make_pkt(self.syn_seq, self.rexpect, b"", start=True, ack=True)
             self.udp_send(synack_pack)
+
+            if self.threaded:
+                self._start_io()
         else:
             print("[error] not SYN")
             return
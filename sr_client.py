@@ -1,9 +1,20 @@
+import sys
+
+from pkt_trace import PacketTracer
 from sr import SRSocket
+from sr_stream import SRStreamSocket
 
 HOST = 'localhost'
 PORT = 8000
 
-s = SRSocket()
+# optional modes: threaded, trace, stream
+modes = sys.argv[1:]
+tracer = PacketTracer('client_trace') if 'trace' in modes else None
+
+if 'stream' in modes:
+    s = SRStreamSocket(tracer=tracer)
+else:
+    s = SRSocket(threaded='threaded' in modes, tracer=tracer)
 s.connect((HOST, PORT))
 print('Connect to', s.address)
 
@@ -11,7 +22,12 @@ f = open('client/data.jpg', 'rb')
 data = f.read()
 f.close()
 
-s.send(data)
-s.send(b"ENDDDDD")
+if 'stream' in modes:
+    st = s.open_stream()
+    st.send(data)
+    st.close()
+else:
+    s.send(data)
+    s.send(b"ENDDDDD")
 print(s.recv().decode())
 s.close()
@@ -1,9 +1,20 @@
+import sys
+
+from pkt_trace import PacketTracer
 from sr import SRSocket
+from sr_stream import SRStreamSocket
 
 HOST = 'localhost'
 PORT = 8000
 
-s = SRSocket()
+# optional modes: threaded, trace, stream
+modes = sys.argv[1:]
+tracer = PacketTracer('server_trace') if 'trace' in modes else None
+
+if 'stream' in modes:
+    s = SRStreamSocket(tracer=tracer)
+else:
+    s = SRSocket(threaded='threaded' in modes, tracer=tracer)
 s.bind((HOST, PORT))
 
 s.listen()
@@ -11,12 +22,22 @@ s.accept()
 print('Connected by', s.address)
 
 f = open('server/recv.jpg', 'wb')
-while True:
-    data = s.recv()
-    if data == b"ENDDDDD":
-        break
-    print(len(data))
-    f.write(data)
+if 'stream' in modes:
+    # the file comes on its own stream, closing it ends the file
+    st = s.accept_stream()
+    while True:
+        data = st.recv()
+        if data == b"":
+            break
+        print(len(data))
+        f.write(data)
+else:
+    while True:
+        data = s.recv()
+        if data == b"ENDDDDD":
+            break
+        print(len(data))
+        f.write(data)
 
 f.close()
 s.send(b"Thank you for your data!")
@@ -0,0 +1,265 @@
+import queue
+import struct
+import threading
+
+from sr import SRSocket, BUFFER_SIZE, IO_WINDOW, QUEUE_SIZE, TIMEOUT, WINDOW_SIZE, LOSS_RATE
+
+# stream header, right after the SR header: stream id, stream seq, stream flag
+STREAM_HEADER = struct.Struct('BBB')
+STREAM_HEADER_SIZE = STREAM_HEADER.size
+STREAM_DATA_SIZE = BUFFER_SIZE - STREAM_HEADER_SIZE
+MAX_STREAMS = 256
+
+# STREAM FLAG
+SFIN = 1
+SCREDIT = 2     # no data, stream seq is the new send limit for the peer
+
+DEFAULT_STREAM = 0      # used by SRStreamSocket.send / recv
+
+
+class SRStream:
+    def __init__(self, conn, sid, queueSize=QUEUE_SIZE):
+        self.conn = conn
+        self.id = sid
+
+        # send (snext / fin_seq / fin_acked are only touched by the I/O thread)
+        self.squeue = queue.Queue(maxsize=queueSize)
+        self.snext = 0              # next stream seq
+        self.closed = False
+        self.fin_seq = None         # connection seq of our SFIN
+        self.fin_acked = False
+        self.slimit = queueSize     # credit: peer has room for stream seqs below this
+
+        # receive (rdata / rexpect / rnext / rlimit / rfin are only touched by the I/O thread)
+        self.rqueue = queue.Queue(maxsize=queueSize)
+        self.rdata = {}             # stream seq -> (flag, data), waiting for rqueue
+        self.rexpect = 0            # next stream seq to deliver
+        self.rnext = 0              # first stream seq not received yet
+        self.rtaken = 0             # packets taken by the app, mod 256
+        self.rlimit = queueSize     # credit last given to the peer
+        self.rfin = False           # SFIN from peer received
+        self.finished = False       # SFIN returned to app
+
+
+    def send(self, data):
+        if self.closed:
+            print(f"[error] stream {self.id} closed")
+            return
+
+        if data == b'':
+            data = [data]
+        else:
+            data = [data[i:i+STREAM_DATA_SIZE] for i in range(0, len(data), STREAM_DATA_SIZE)]
+
+        for pkt_data in data:
+            if not self.conn._queue_put(self.squeue, (0, pkt_data)):
+                return
+
+
+    def recv(self, size=BUFFER_SIZE):
+        if self.finished:
+            return b""
+
+        item = self.conn._queue_get(self.rqueue)
+        if item is None:
+            return b""
+        flag, data = item
+
+        self.rtaken = (self.rtaken + 1) % 256
+        if flag & SFIN:
+            self.finished = True
+            return b""
+        return data[:size]
+
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.conn._queue_put(self.squeue, (SFIN, b""))
+
+
+class SRStreamSocket(SRSocket):
+    # several independent streams over one SR connection
+    def __init__(self, timeout=TIMEOUT,
+                    windowSize=WINDOW_SIZE, lossRate=LOSS_RATE,
+                    queueSize=QUEUE_SIZE, tracer=None):
+        super().__init__(timeout, windowSize, lossRate,
+                         threaded=True, queueSize=queueSize, tracer=tracer)
+        self.queue_size = queueSize
+
+        self.streams = {}               # id -> SRStream
+        self.streams_lock = threading.Lock()
+        self.new_streams = queue.Queue()    # opened by peer, waiting for accept_stream
+        self.first_sid = 0
+        self.rr = 0                     # round robin position
+        self.credits = []               # (id, limit) to send to the peer, I/O thread only
+        self.draining = []              # replaced streams with data still waiting for rqueue
+
+
+    def open_stream(self):
+        if self.io_thread is None or not self.io_thread.is_alive():
+            print("[error] not connected")
+            return None
+
+        with self.streams_lock:
+            # ids of finished streams are free again
+            for sid in range(self.first_sid, MAX_STREAMS, 2):
+                if sid not in self.streams:
+                    break
+            else:
+                print("[error] too many streams")
+                return None
+            stream = SRStream(self, sid, self.queue_size)
+            self.streams[sid] = stream
+        return stream
+
+
+    def accept_stream(self):
+        if self.io_thread is None:
+            return None
+        return self._queue_get(self.new_streams)
+
+
+    def send(self, data):
+        if (not self.connected):
+            print("[error] not connected")
+            return
+        self.streams[DEFAULT_STREAM].send(data)
+
+
+    def recv(self, size=BUFFER_SIZE):
+        if self.io_thread is None:
+            return b""
+        return self.streams[DEFAULT_STREAM].recv(size)
+
+
+    def _start_io(self):
+        # client opens even stream ids, server odd ones, 0 is shared
+        self.first_sid = 1 if self.is_server else 2
+        self.streams[DEFAULT_STREAM] = SRStream(self, DEFAULT_STREAM, self.queue_size)
+        super()._start_io()
+
+
+    def _get_stream(self, sid):
+        with self.streams_lock:
+            stream = self.streams.get(sid)
+            # the old stream with this id got its SFIN, so this is a new stream reusing the id
+            if stream is None or (stream.rfin and sid != DEFAULT_STREAM):
+                if stream is not None and stream.rdata:
+                    self.draining.append(stream)
+                stream = SRStream(self, sid, self.queue_size)
+                self.streams[sid] = stream
+                self.new_streams.put(stream)
+        return stream
+
+
+    def _fill(self):
+        self._reap()
+
+        # one packet per stream per round, so every stream gets the same share of the window;
+        # only fill what cwnd lets out, so a new stream does not queue behind a bulk one
+        with self.streams_lock:
+            streams = list(self.streams.values())
+
+        # credit updates first, they are tiny and the peer may be waiting for them
+        while self.credits and (self.spos - self.sbase) % 256 < IO_WINDOW:
+            sid, limit = self.credits.pop(0)
+            stream = self.streams.get(sid)
+            if stream is None or stream.rfin:
+                continue    # peer is done sending on it, the id may be reused soon
+            self.sdata[self.spos] = STREAM_HEADER.pack(sid, limit, SCREDIT)
+            self.spos = (self.spos + 1) % 256
+
+        idle = 0
+        while (len(self.sclkq) + (self.spos - self.snext) % 256 < self.window_size
+               and (self.spos - self.sbase) % 256 < IO_WINDOW and idle < len(streams)):
+            stream = streams[self.rr % len(streams)]
+            self.rr += 1
+            # per stream flow control: no credit left, the peer's app has not read enough
+            if (stream.snext - stream.slimit) % 256 < 128:
+                idle += 1
+                continue
+            try:
+                flag, data = stream.squeue.get_nowait()
+            except queue.Empty:
+                idle += 1
+                continue
+            idle = 0
+
+            self.sdata[self.spos] = STREAM_HEADER.pack(stream.id, stream.snext, flag) + data
+            if flag & SFIN:
+                stream.fin_seq = self.spos
+            stream.snext = (stream.snext + 1) % 256
+            self.spos = (self.spos + 1) % 256
+
+
+    def _reap(self):
+        # drop streams finished in both directions, their ids can be reused
+        with self.streams_lock:
+            for sid, stream in list(self.streams.items()):
+                if stream.fin_seq is not None and not stream.fin_acked:
+                    # acked once the send base has passed it
+                    stream.fin_acked = (stream.fin_seq - self.sbase) % 256 >= (self.spos - self.sbase) % 256
+                if sid != DEFAULT_STREAM and stream.fin_acked and stream.finished:
+                    del self.streams[sid]
+
+
+    def _on_data(self, seqNum, data):
+        # reassemble per stream, a gap in one stream does not hold back the others
+        if len(data) < STREAM_HEADER_SIZE:
+            print("[error] invalid stream packet")
+            return True
+        sid, sseq, flag = STREAM_HEADER.unpack(data[:STREAM_HEADER_SIZE])
+
+        if flag & SCREDIT:
+            with self.streams_lock:
+                stream = self.streams.get(sid)
+            # limits only grow, an old credit can arrive after a newer one
+            if stream is not None and (sseq - stream.slimit) % 256 < 128:
+                stream.slimit = sseq
+            return
+
+        stream = self._get_stream(sid)
+        stream.rdata[sseq] = (flag, data[STREAM_HEADER_SIZE:])
+        while stream.rnext in stream.rdata:
+            if stream.rdata[stream.rnext][0] & SFIN:
+                stream.rfin = True
+            stream.rnext = (stream.rnext + 1) % 256
+        self._deliver_stream(stream)
+
+
+    def _deliver(self):
+        # data already went to the streams in _on_data, just free the slots
+        while self.rbase != self.rexpect:
+            self.rdata[self.rbase] = None
+            self.rbase = (self.rbase + 1) % 256
+
+        # the app may have made room in some rqueue since the last round
+        with self.streams_lock:
+            streams = list(self.streams.values())
+        for stream in streams + self.draining:
+            self._deliver_stream(stream)
+            if not stream.rfin:
+                # give more credit once half of the queue is free again
+                limit = (stream.rtaken + self.queue_size) % 256
+                if (limit - stream.rlimit) % 256 >= max(1, self.queue_size // 2):
+                    stream.rlimit = limit
+                    self.credits.append((stream.id, limit))
+        self.draining = [stream for stream in self.draining if stream.rdata]
+
+
+    def _deliver_stream(self, stream):
+        # in order to rqueue, as far as it has room
+        while stream.rexpect in stream.rdata:
+            try:
+                stream.rqueue.put_nowait(stream.rdata[stream.rexpect])
+            except queue.Full:
+                return
+            del stream.rdata[stream.rexpect]
+            stream.rexpect = (stream.rexpect + 1) % 256
+
+
+    def _send_pending(self):
+        with self.streams_lock:
+            return any(not stream.squeue.empty() for stream in self.streams.values())
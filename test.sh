@@ -34,16 +34,17 @@ if [ "$1" == "gbn" ]; then
 fi
 
 if [ "$1" == "sr" ]; then
-    echo "Testing Selective Repeat"
+    modes="${@:2}"
+    echo "Testing Selective Repeat $modes"
     for ((i=1; i<=$num_runs; i++)); do
         rm ./server_log
         rm ./client_log
-        python ./sr_server.py 1> ./server_log &
+        python ./sr_server.py $modes 1> ./server_log &
         server_pid=$!
 
         sleep 1
 
-        python ./sr_client.py 1> ./client_log
+        python ./sr_client.py $modes 1> ./client_log
 
         wait $server_pid
 
@@ -55,10 +56,25 @@ if [ "$1" == "sr" ]; then
             break
         fi
 
+        grep -q "Thank you for your data!" ./client_log
+        if [ $? -ne 0 ]; then
+            echo "Test $i: Reply not received"
+            break
+        fi
+
+        if [[ " $modes " == *" trace "* ]]; then
+            python ./trace_analyzer.py ./server_trace -o ./trace_out/server 1> /dev/null && \
+            python ./trace_analyzer.py ./client_trace -o ./trace_out/client 1> /dev/null
+            if [ $? -ne 0 ]; then
+                echo "Test $i: Trace analysis failed"
+                break
+            fi
+        fi
+
         sleep 4
     done
     exit
 fi
 
-echo "Usage: ./test.sh gbn|sr"
+echo "Usage: ./test.sh gbn|sr [threaded] [trace] [stream]"
 exit
@@ -0,0 +1,165 @@
+import argparse
+import csv
+import os
+
+from pkt_trace import (read_trace, EVENT_NAMES, DROP_NAMES, KIND_GBN,
+                       EV_CONN, EV_SEND, EV_RETRANS, EV_RECV, EV_ACK, EV_DROP, EV_CWND, EV_RTO,
+                       DROP_CHECKSUM, DROP_WINDOW, DROP_ORDER)
+
+# FLAG (same as gbn.py / sr.py)
+SYN = 1
+FIN = 2
+ACK = 4
+
+STALL_TIME = 1.0    # seconds without progress
+
+
+def is_data(flag):
+    return flag & (SYN | FIN | ACK) == 0
+
+
+def rejected(records, i):
+    # the receive path logs a drop right after the packet it refused
+    if i + 1 >= len(records):
+        return False
+    t, conn, event, seq, ack, flag, length, value = records[i + 1]
+    return event == EV_DROP and seq == records[i][3] and value in (DROP_CHECKSUM, DROP_WINDOW, DROP_ORDER)
+
+
+def analyse_conn(records, stall_time=STALL_TIME):
+    # rebuild the time series of one connection
+    kind = None
+    cwnd = 0
+    start = records[0][0]
+
+    outstanding = {}    # seq -> (send time, length)
+    retransmitted = set()
+    inflight = 0
+    abs_seq = None      # seq without the mod 256 wrap
+
+    rexpect = None      # next in-order seq from the peer
+    rbuffered = {}      # seq -> length, received out of order
+
+    rows = []
+    stalls = []
+    last_progress = start
+    stats = {'send': 0, 'retrans': 0, 'recv': 0, 'dup': 0, 'drop': 0, 'rto': 0,
+             'bytes_acked': 0, 'bytes_recv': 0, 'rtt': []}
+
+    for i, (t, conn, event, seq, ack, flag, length, value) in enumerate(records):
+        rtt = ''
+        progress = False
+
+        if event == EV_CONN:
+            kind = value
+        elif event == EV_CWND:
+            cwnd = value
+        elif event == EV_RTO:
+            stats['rto'] += 1
+        elif event == EV_DROP:
+            stats['drop'] += 1
+        elif event in (EV_SEND, EV_RETRANS) and is_data(flag):
+            if event == EV_SEND:
+                stats['send'] += 1
+                if abs_seq is None:
+                    abs_seq = seq
+                elif (seq - abs_seq) % 256 < 128:
+                    abs_seq += (seq - abs_seq) % 256
+            else:
+                stats['retrans'] += 1
+                retransmitted.add(seq)
+            if seq not in outstanding:
+                inflight += length
+            outstanding[seq] = (outstanding[seq][0] if seq in outstanding else t, length)
+        elif event in (EV_RECV, EV_ACK) and flag & SYN:
+            # handshake: the peer's data starts right after its SYN seq
+            if rexpect is None:
+                rexpect = (seq + 1) % 256
+        elif event == EV_RECV and is_data(flag) and not rejected(records, i):
+            if rexpect is None:
+                rexpect = seq
+            if (seq - rexpect) % 256 < 128 and seq not in rbuffered:
+                rbuffered[seq] = length
+                while rexpect in rbuffered:
+                    stats['recv'] += 1
+                    stats['bytes_recv'] += rbuffered.pop(rexpect)
+                    rexpect = (rexpect + 1) % 256
+                    progress = True
+            else:
+                stats['dup'] += 1
+        elif event == EV_ACK and not (flag & (SYN | FIN)):
+            if kind == KIND_GBN:
+                # cumulative: ack is the next expected seq
+                acked = [s for s in outstanding if (ack - 1 - s) % 256 < 128]
+            else:
+                acked = [ack] if ack in outstanding else []
+            for s in acked:
+                send_time, s_len = outstanding.pop(s)
+                inflight -= s_len
+                stats['bytes_acked'] += s_len
+                if s == (ack - 1) % 256 or s == ack:
+                    # Karn: no sample from retransmitted packets
+                    if s not in retransmitted:
+                        rtt = t - send_time
+                        stats['rtt'].append(rtt)
+                retransmitted.discard(s)
+            progress = len(acked) > 0
+
+        if progress:
+            if t - last_progress >= stall_time:
+                stalls.append((last_progress - start, t - start, t - last_progress))
+            last_progress = t
+
+        name = EVENT_NAMES[event] if event < len(EVENT_NAMES) else str(event)
+        if event == EV_DROP and value < len(DROP_NAMES):
+            name += '/' + DROP_NAMES[value]
+        rows.append([f"{t - start:.6f}", name, seq, ack, flag, length,
+                     '' if abs_seq is None else abs_seq, inflight, cwnd,
+                     '' if rtt == '' else f"{rtt:.6f}"])
+
+    # a stall that lasts until the end of the trace
+    end = records[-1][0]
+    if end - last_progress >= stall_time:
+        stalls.append((last_progress - start, end - start, end - last_progress))
+
+    stats['duration'] = end - start
+    return rows, stalls, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyse a packet trace recorded by PacketTracer')
+    parser.add_argument('trace', help='trace file')
+    parser.add_argument('-o', '--output', default='.', help='directory for the CSV files')
+    parser.add_argument('-s', '--stall', type=float, default=STALL_TIME,
+                        help='seconds without progress counted as a stall')
+    args = parser.parse_args()
+
+    conns = {}
+    for r in read_trace(args.trace):
+        conns.setdefault(r[1], []).append(r)
+
+    os.makedirs(args.output, exist_ok=True)
+    for conn, records in sorted(conns.items()):
+        rows, stalls, stats = analyse_conn(records, args.stall)
+
+        with open(os.path.join(args.output, f'conn{conn}_series.csv'), 'w', newline='') as f:
+            w = csv.writer(f)
+            w.writerow(['time', 'event', 'seq', 'ack', 'flag', 'len', 'abs_seq', 'inflight_bytes', 'cwnd', 'rtt'])
+            w.writerows(rows)
+        with open(os.path.join(args.output, f'conn{conn}_stalls.csv'), 'w', newline='') as f:
+            w = csv.writer(f)
+            w.writerow(['start', 'end', 'duration'])
+            w.writerows([[f"{a:.6f}", f"{b:.6f}", f"{c:.6f}"] for a, b, c in stalls])
+
+        rtt = stats['rtt']
+        duration = stats['duration']
+        print(f"[conn {conn}] {duration:.2f}s, sent {stats['send']}, retrans {stats['retrans']}, "
+              f"recv {stats['recv']}, dup {stats['dup']}, drop {stats['drop']}, rto {stats['rto']}")
+        print(f"    acked {stats['bytes_acked']} B ({stats['bytes_acked'] / duration if duration else 0:.0f} B/s), "
+              f"recv {stats['bytes_recv']} B, "
+              f"rtt avg {sum(rtt) / len(rtt) if rtt else 0:.3f}s ({len(rtt)} samples), "
+              f"stalls {len(stalls)} ({sum(s[2] for s in stalls):.2f}s)")
+
+
+if __name__ == '__main__':
+    main()